@@ -0,0 +1,113 @@
+# startup time, measured before any other import
+import time
+started_at = time.time()
+
+# sys
+import sys
+
+# termination by a service manager
+import signal
+
+# command line arguments
+import argparse
+
+# threads
+import threading
+
+# Aggregator
+from network.aggregator import Aggregator
+
+# logger configuration
+from output.options import add_logger_arguments
+from output.options import check_logger_arguments
+from output.options import create_logger_factory
+
+# latest state table
+from device.latest_state import LatestState
+
+# startup time and memory report
+from device.process_stats import report_process_stats
+
+def terminate(signum, frame):
+    """
+    Handle SIGTERM, e.g. sent by a service manager, as a KeyboardInterrupt
+    so that the connections and their logs are closed.
+    """
+
+    # further signals must not interrupt the shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+def parse_arguments():
+    """
+    Parse the command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Aggregate data forwarded by several collectors.')
+
+    # listening address
+    parser.add_argument('--host', default='0.0.0.0',\
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=7800,\
+                        help='port to listen on')
+
+    # throughput report
+    parser.add_argument('--report-interval', type=float, default=0,\
+                        help='report the number of messages received every REPORT_INTERVAL seconds')
+
+    # latest state table
+    parser.add_argument('--state-name', default='evb1000_latest_state',\
+                        help='name of the shared memory block storing the latest state of each device')
+
+    # loggers
+    add_logger_arguments(parser)
+
+    args = parser.parse_args()
+    check_logger_arguments(parser, args)
+
+    return args
+
+if __name__ == '__main__':
+
+    # parse command line
+    args = parse_arguments()
+
+    # create the latest state table shared with local readers
+    latest_state = LatestState.create(args.state_name)
+
+    # instantiate the aggregator
+    aggregator = Aggregator((args.host, args.port), create_logger_factory(args), latest_state)
+
+    # serve gateways on a separate thread
+    server = threading.Thread(target=aggregator.serve_forever)
+    server.start()
+
+    report_process_stats('Aggregator', started_at)
+
+    # stop as on a keyboard interrupt when terminated
+    signal.signal(signal.SIGTERM, terminate)
+
+    try:
+        last_received = 0
+        last_time = time.time()
+
+        while True:
+            if args.report_interval > 0:
+                time.sleep(args.report_interval)
+
+                # report throughput
+                now = time.time()
+                received = aggregator.received
+                sys.stderr.write('Aggregator[' + time.strftime("%d-%m-%Y %H:%M:%S") + ']: ' +\
+                                 '%.1f msg/s' % ((received - last_received) / (now - last_time)) +\
+                                 ', ' + str(len(aggregator.connections)) + ' connections\n')
+                last_received = received
+                last_time = now
+            else:
+                time.sleep(1)
+
+    except KeyboardInterrupt:
+        aggregator.close()
+        server.join()
+        latest_state.close()
+        sys.exit(0)
@@ -0,0 +1,285 @@
+import os
+import csv
+import json
+import zlib
+
+# numpy is required only by the analysis tools
+import numpy as np
+
+# fields containing strings, every other field is numeric
+STRING_FIELDS = ['msg_type', 'flag']
+
+# number of bytes preceding the parsed offset used
+# to detect files rewritten instead of appended
+CHECK_BYTES = 64
+
+class InconsistentLogFile(Exception):
+    pass
+
+class LogLoader:
+    """
+    Load csv logs written by CSVLogger as numpy columns.
+
+    A log is parsed once into a columnar cache stored next to it,
+    in the directory <filename>.cache, containing one raw binary file
+    for each column and a meta.json file with the dtype of each column
+    and the size and the mtime of the log at the time of parsing.
+
+    Later loads memory-map the cache if the log did not change.
+    If the log was appended in the meantime only the new tail is
+    parsed and appended to the column files, which are rewritten
+    only if a string column needs a larger width.
+    """
+
+    def __init__(self, filename):
+
+        # save filename
+        self.filename = filename
+
+        # number of malformed rows skipped by the last parse
+        self.skipped = 0
+
+        # cache location
+        self.cache_dir = filename + '.cache'
+        self.meta_filename = os.path.join(self.cache_dir, 'meta.json')
+
+    def column_filename(self, field, dtype):
+        """
+        Return the path of the cache file of the column field of type dtype.
+
+        The type is part of the name so that widening a string column
+        never alters the file described by the current metadata.
+        """
+        return os.path.join(self.cache_dir, field + '_' + dtype.kind +\
+                            str(dtype.itemsize) + '.bin')
+
+    def load(self):
+        """
+        Return a dictionary mapping each field of the log to a numpy array.
+        """
+
+        stat = os.stat(self.filename)
+        meta = self.load_meta()
+
+        # the cache is up to date
+        if meta is not None and meta['size'] == stat.st_size and\
+           meta['mtime'] == stat.st_mtime_ns:
+            return self.load_columns(meta)
+
+        # the log was appended, parse only the tail, unless the log was
+        # empty when cached and its header is still unknown
+        if meta is not None and meta['fields'] and\
+           meta['size'] <= stat.st_size and self.check_prefix(meta):
+            tail, offset = self.parse(meta['offset'], meta['fields'])
+            self.append(meta, tail, offset, stat)
+
+        # the cache is missing or the log was rewritten, parse the whole log
+        else:
+            columns, offset = self.parse(0, None)
+            self.store(columns, offset, stat)
+
+        return self.load_columns(self.load_meta())
+
+    def load_meta(self):
+        """
+        Return the content of meta.json or None if the cache is missing.
+        """
+
+        try:
+            with open(self.meta_filename, 'r') as fd:
+                meta = json.load(fd)
+        except (OSError, IOError, ValueError):
+            return None
+
+        # ignore caches written by older versions
+        if not 'dtypes' in meta:
+            return None
+
+        return meta
+
+    def load_columns(self, meta):
+        """
+        Memory-map the columns stored in the cache.
+        """
+
+        columns = dict()
+        for field in meta['fields']:
+            dtype = np.dtype(meta['dtypes'][field])
+
+            # empty files cannot be memory-mapped
+            if meta['rows'] == 0:
+                columns[field] = np.zeros(0, dtype=dtype)
+            else:
+                columns[field] = np.memmap(self.column_filename(field, dtype), dtype=dtype,\
+                                           mode='r', shape=(meta['rows'],))
+
+        return columns
+
+    def check_prefix(self, meta):
+        """
+        Return True if the bytes preceding the parsed offset are unchanged,
+        i.e. if the log was appended and not rewritten.
+        """
+
+        start = max(meta['offset'] - CHECK_BYTES, 0)
+
+        with open(self.filename, 'rb') as fd:
+            fd.seek(start)
+            data = fd.read(meta['offset'] - start)
+
+        return zlib.crc32(data) == meta['check']
+
+    def parse(self, offset, fields):
+        """
+        Parse the complete lines of the log starting from offset.
+
+        Rows whose length does not match the header or whose numeric
+        values cannot be parsed, e.g. a line cut by a crash and completed
+        by the header written on the next start, are skipped and counted.
+
+        Return a dictionary of columns and the offset following the last parsed line.
+        """
+
+        with open(self.filename, 'rb') as fd:
+            fd.seek(offset)
+            data = fd.read()
+
+        # ignore a partially written last line
+        end = data.rfind(b'\n') + 1
+        lines = data[:end].decode('utf-8').splitlines()
+
+        rows = []
+        self.skipped = 0
+        for row in csv.reader(lines):
+            if not row:
+                continue
+
+            # a header is written every time the log is opened
+            if row[0] == 'msg_type':
+                if fields is None:
+                    fields = row
+                elif row != fields:
+                    raise InconsistentLogFile
+                continue
+
+            if fields is None or len(row) != len(fields):
+                self.skipped = self.skipped + 1
+                continue
+
+            try:
+                row = [value if field in STRING_FIELDS else float(value)\
+                       for field, value in zip(fields, row)]
+            except ValueError:
+                self.skipped = self.skipped + 1
+                continue
+
+            rows.append(row)
+
+        if fields is None:
+            fields = []
+
+        columns = dict()
+        for index, field in enumerate(fields):
+            values = [row[index] for row in rows]
+            if field in STRING_FIELDS:
+                columns[field] = np.array(values, dtype=str)
+            else:
+                columns[field] = np.array(values, dtype=np.float64)
+
+        return columns, offset + end
+
+    def store(self, columns, offset, stat):
+        """
+        Write the columns and the metadata to the cache.
+        """
+
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        fields = list(columns.keys())
+
+        # columns are replaced atomically
+        for field in fields:
+            filename = self.column_filename(field, columns[field].dtype)
+            with open(filename + '.tmp', 'wb') as fd:
+                fd.write(columns[field].tobytes())
+            os.replace(filename + '.tmp', filename)
+
+        dtypes = dict((field, columns[field].dtype.str) for field in fields)
+        rows = len(columns[fields[0]]) if fields else 0
+
+        self.store_meta(fields, dtypes, rows, offset, stat)
+
+        # remove the files of a previous cache
+        current = [os.path.basename(self.column_filename(field, columns[field].dtype))\
+                   for field in fields]
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.bin') and not name in current:
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def append(self, meta, tail, offset, stat):
+        """
+        Append the columns in tail to the cache and update the metadata.
+        """
+
+        rows = meta['rows']
+        dtypes = dict(meta['dtypes'])
+
+        # files of the columns that were widened
+        replaced = []
+
+        for field in meta['fields']:
+            dtype = np.dtype(dtypes[field])
+            filename = self.column_filename(field, dtype)
+            values = tail[field]
+
+            # strings longer than the width of the column
+            # require the whole column to be rewritten
+            if values.dtype.kind == 'U' and values.dtype.itemsize > dtype.itemsize:
+                column = np.fromfile(filename, dtype=dtype, count=rows)
+                column = np.concatenate((column, values))
+                with open(self.column_filename(field, column.dtype), 'wb') as fd:
+                    fd.write(column.tobytes())
+                dtypes[field] = column.dtype.str
+                replaced.append(filename)
+                continue
+
+            # drop data appended by a load interrupted before updating
+            # the metadata, then append the tail
+            with open(filename, 'r+b') as fd:
+                fd.truncate(rows * dtype.itemsize)
+                fd.seek(0, os.SEEK_END)
+                fd.write(values.astype(dtype).tobytes())
+
+        rows = rows + len(tail[meta['fields'][0]])
+
+        self.store_meta(meta['fields'], dtypes, rows, offset, stat)
+
+        for filename in replaced:
+            os.remove(filename)
+
+    def store_meta(self, fields, dtypes, rows, offset, stat):
+        """
+        Write the metadata to the cache.
+        """
+
+        # checksum of the bytes preceding offset
+        start = max(offset - CHECK_BYTES, 0)
+        with open(self.filename, 'rb') as fd:
+            fd.seek(start)
+            check = zlib.crc32(fd.read(offset - start))
+
+        meta = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,\
+                'offset': offset, 'check': check, 'fields': fields,\
+                'dtypes': dtypes, 'rows': rows}
+
+        # metadata are written last so that the cache is valid only if complete
+        with open(self.meta_filename + '.tmp', 'w') as fd:
+            json.dump(meta, fd)
+        os.replace(self.meta_filename + '.tmp', self.meta_filename)
+
+def load_log(filename):
+    """
+    Return a dictionary mapping each field of the csv log filename to a numpy array.
+    """
+    return LogLoader(filename).load()
@@ -0,0 +1,245 @@
+"""
+Measure the forwarding overhead on a gateway and the throughput
+of an aggregator receiving from several gateways over localhost,
+or check that forwarded messages are received unaltered.
+
+Usage: python -m benchmarks.forwarding [gateways] [messages per gateway]
+       python -m benchmarks.forwarding check
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import threading
+import multiprocessing
+
+# EVB1000 decoder
+from device.decoder import DataFromEVB1000
+
+# CSV logger
+from output.csv_logger import CSVLogger
+
+# forwarding
+from network.forwarder import Forwarder
+from network.aggregator import Aggregator
+
+# logger factory
+from functools import partial
+
+# example lines, one for each message type
+LINES = [b'tpr 02 412570a4 412570a4 412570a4\r\n',
+         b'trr 02 000003e8 000003e9 000003ea 000003eb\r\n',
+         b'arr 01 00 01 02 3f800000 ab\r\n']
+
+class NullLogger:
+    """
+    Logger discarding every message, used to measure the aggregator alone.
+    """
+
+    def log_data(self, evb1000_data):
+        pass
+
+    def close(self):
+        pass
+
+class RecordingLogger:
+    """
+    Logger storing the content of every message in the list received.
+    """
+
+    def __init__(self, received):
+        self.received = received
+
+    def log_data(self, evb1000_data):
+        self.received.append(content(evb1000_data))
+
+    def close(self):
+        pass
+
+def content(evb1000_data):
+    """
+    Return the timestamp, the fields and the decoded values of a message.
+    """
+    return (evb1000_data.timestamp, list(evb1000_data.msg_fields),\
+            dict(evb1000_data.decoded))
+
+def messages(count):
+    """
+    Return count decoded messages.
+    """
+    return [DataFromEVB1000(LINES[i % len(LINES)]) for i in range(count)]
+
+def flagged_messages(count):
+    """
+    Return count decoded messages, with outliers flagged
+    in the ranges as done by the range filter.
+    """
+    data = messages(count)
+    for i, evb1000_data in enumerate(data):
+        if evb1000_data.decoded['msg_type'] in ['trr', 'arr']:
+            evb1000_data.msg_fields = evb1000_data.msg_fields + ['outliers']
+            evb1000_data.decoded['outliers'] = i % 16
+
+    return data
+
+def start_aggregator(logger_factory, port=0):
+    """
+    Return an aggregator listening on port and the thread serving it.
+    """
+    aggregator = Aggregator(('127.0.0.1', port), logger_factory)
+    server = threading.Thread(target=aggregator.serve_forever)
+    server.start()
+
+    return aggregator, server
+
+def wait_received(received, count, timeout=10.0):
+    """
+    Wait until count messages are in received, at most timeout seconds.
+    """
+    deadline = time.time() + timeout
+    while len(received) < count and time.time() < deadline:
+        time.sleep(0.01)
+
+def check_round_trip(count=3000):
+    """
+    Return True if count forwarded messages, some with outliers flagged,
+    are received unaltered and in order.
+    """
+    received = []
+    aggregator, server = start_aggregator(partial(RecordingLogger, received))
+
+    data = flagged_messages(count)
+    forwarder = Forwarder('127.0.0.1', aggregator.server_address[1], 'check',\
+                          close_timeout=10.0)
+    for evb1000_data in data:
+        forwarder.log_data(evb1000_data)
+    forwarder.close()
+
+    wait_received(received, count)
+    aggregator.close()
+    server.join()
+
+    return received == [content(evb1000_data) for evb1000_data in data]
+
+def check_resend(count=3000):
+    """
+    Return True if no message is lost when the aggregator is restarted
+    while a gateway is forwarding, i.e. if the batch whose transmission
+    failed is sent again after reconnecting.
+    """
+    received = []
+    factory = partial(RecordingLogger, received)
+
+    # reserve a port, used by both aggregators
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    aggregator, server = start_aggregator(factory, port)
+
+    data = flagged_messages(count)
+    forwarder = Forwarder('127.0.0.1', port, 'check', close_timeout=10.0)
+
+    # first half received by the first aggregator
+    for evb1000_data in data[:count // 2]:
+        forwarder.log_data(evb1000_data)
+    wait_received(received, count // 2)
+    aggregator.close()
+    server.join()
+
+    # second half forwarded while the aggregator is down
+    for evb1000_data in data[count // 2:]:
+        forwarder.log_data(evb1000_data)
+    time.sleep(0.5)
+
+    aggregator, server = start_aggregator(factory, port)
+    forwarder.close()
+
+    wait_received(received, count)
+    aggregator.close()
+    server.join()
+
+    return forwarder.dropped == 0 and\
+           received == [content(evb1000_data) for evb1000_data in data]
+
+def time_per_message(logger, data):
+    """
+    Return the time spent by logger.log_data() for each message in data, in microseconds.
+    """
+    start = time.perf_counter()
+    for evb1000_data in data:
+        logger.log_data(evb1000_data)
+    elapsed = time.perf_counter() - start
+    logger.close()
+
+    return elapsed / len(data) * 1e6
+
+def gateway(port, count):
+    """
+    Forward count messages to the aggregator listening on port.
+    """
+    forwarder = Forwarder('127.0.0.1', port, 'benchmark', max_buffered=count,\
+                          close_timeout=60.0)
+    for evb1000_data in messages(count):
+        forwarder.log_data(evb1000_data)
+    forwarder.close()
+
+def aggregator_throughput(logger_factory, gateways, count):
+    """
+    Return the number of messages per second received by an aggregator
+    from gateways processes forwarding count messages each.
+    """
+    aggregator = Aggregator(('127.0.0.1', 0), logger_factory)
+    port = aggregator.server_address[1]
+    server = threading.Thread(target=aggregator.serve_forever)
+    server.start()
+
+    processes = [multiprocessing.Process(target=gateway, args=(port, count))\
+                 for i in range(gateways)]
+
+    start = time.perf_counter()
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+    # wait for the last messages to be processed
+    deadline = time.time() + 60.0
+    while aggregator.received < gateways * count and time.time() < deadline:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    aggregator.close()
+    server.join()
+
+    return aggregator.received, aggregator.received / elapsed
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['check']:
+        failed = False
+        for name, check in [('round trip', check_round_trip),\
+                            ('resend after reconnecting', check_resend)]:
+            passed = check()
+            failed = failed or not passed
+            print('%s: %s' % (name, 'ok' if passed else 'FAILED'))
+        sys.exit(1 if failed else 0)
+
+    gateways = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+
+    # log files are written in a temporary directory
+    os.chdir(tempfile.mkdtemp())
+
+    data = messages(count)
+
+    print('gateway, CSVLogger.log_data:  %.2f us/msg' % time_per_message(CSVLogger(), data))
+    print('gateway, Forwarder.log_data:  %.2f us/msg' %\
+          time_per_message(Forwarder('127.0.0.1', 1, max_buffered=count, close_timeout=0), data))
+
+    received, rate = aggregator_throughput(NullLogger, gateways, count)
+    print('aggregator, %d gateways, no logging:  %d msg, %.0f msg/s' % (gateways, received, rate))
+
+    received, rate = aggregator_throughput(CSVLogger, gateways, count)
+    print('aggregator, %d gateways, CSVLogger:   %d msg, %.0f msg/s' % (gateways, received, rate))
@@ -1,21 +1,119 @@
+# startup time, measured before any other import
+import time
+started_at = time.time()
+
 # sys
+import os
 import sys
 
+# termination by a service manager
+import signal
+
+# command line arguments
+import argparse
+
+# logger factory
+from functools import partial
+
 # DeviceManager
 from device.device_manager import DeviceManager
 from device.device_manager import DeviceVIDPIDList
 
+# logger configuration
+from output.options import add_logger_arguments
+from output.options import check_logger_arguments
+from output.options import create_logger_factory
+
+# startup time and memory report
+from device.process_stats import report_process_stats
+
+def terminate(main_pid, signum, frame):
+    """
+    Handle SIGTERM, e.g. sent by a service manager, as a KeyboardInterrupt
+    so that the devices are stopped and the logs are closed.
+    """
+
+    # device processes install their own handler when started,
+    # before that they stop as on a keyboard interrupt
+    if os.getpid() != main_pid:
+        raise KeyboardInterrupt
+
+    # further signals must not interrupt the shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+def parse_arguments():
+    """
+    Parse the command line arguments.
+    """
+
+    parser = argparse.ArgumentParser(description='Collect data from DecaWave EVB1000 devices.')
+
+    # headless mode
+    parser.add_argument('--headless', action='store_true',\
+                        help='run without progress meters, e.g. as a system service')
+
+    # latest state table
+    parser.add_argument('--state-name', default='evb1000_latest_state',\
+                        help='name of the shared memory block storing the latest state of each device')
+
+    # range filtering
+    parser.add_argument('--filter-ranges', choices=['flag', 'drop'],\
+                        help='flag or drop outlying ranges of trr and arr messages')
+    parser.add_argument('--filter-window', type=int, default=15,\
+                        help='number of ranges of each link used to detect outliers')
+    parser.add_argument('--filter-threshold', type=float, default=3.5,\
+                        help='outlier threshold in scaled median absolute deviations')
+
+    # forwarding to an aggregator
+    parser.add_argument('--forward', metavar='HOST:PORT',\
+                        help='forward messages to an aggregator instead of logging them')
+    parser.add_argument('--forward-buffer', type=int, default=100000,\
+                        help='maximum number of messages buffered while disconnected, for each device')
+
+    # loggers
+    add_logger_arguments(parser)
+
+    args = parser.parse_args()
+    check_logger_arguments(parser, args)
+
+    return args
+
 if __name__ == '__main__':
 
+    # parse command line
+    args = parse_arguments()
+
     # load VIDs and PIDs from config.ini
     vid_pid_list = DeviceVIDPIDList('config.ini')
 
+    # configure the logger used by each device
+    if args.forward is not None:
+        from network.forwarder import Forwarder
+        host, port = args.forward.rsplit(':', 1)
+        logger_factory = partial(Forwarder, host, int(port), max_buffered=args.forward_buffer)
+    else:
+        logger_factory = create_logger_factory(args)
+
+    # configure the range filter used by each device, numpy is imported only if required
+    range_filter_factory = None
+    if args.filter_ranges is not None:
+        from device.range_filter import RangeFilter
+        range_filter_factory = partial(RangeFilter, args.filter_ranges,\
+                                       args.filter_window, args.filter_threshold)
+
     # instantiate device_manager
-    dev_man = DeviceManager(vid_pid_list)
+    dev_man = DeviceManager(vid_pid_list, logger_factory, args.headless, args.state_name,\
+                            range_filter_factory)
+
+    report_process_stats('DeviceManager', started_at)
+
+    # stop as on a keyboard interrupt when terminated
+    signal.signal(signal.SIGTERM, partial(terminate, os.getpid()))
 
     try:
         # run the device manager
         dev_man.run()
     except KeyboardInterrupt:
-        dev_man.stop_all_devices()
+        dev_man.close()
         sys.exit(0)
@@ -1,4 +1,5 @@
 import struct
+import time
 
 def decode_unsigned_int(string):
     """
@@ -44,6 +45,9 @@ class DataFromEVB1000:
     """
 
     def __init__(self, line):
+
+        # save reception time
+        self.timestamp = time.time()
         
         # remove trailing '\r\n' from the line
         self.line = line[:-2]
@@ -65,6 +69,30 @@ class DataFromEVB1000:
         if (self.msg_type_decoded):
             self.decode()
 
+    @classmethod
+    def from_decoded(cls, msg_type, timestamp):
+        """
+        Return an instance of msg_type, received at timestamp, whose decoded
+        fields are filled by the caller, e.g. when received from a gateway.
+
+        Raise InvalidDataFromEVB1000 if msg_type is unknown.
+        """
+
+        evb1000_data = cls.__new__(cls)
+
+        evb1000_data.timestamp = timestamp
+        evb1000_data.line = msg_type
+        evb1000_data.msg_type = ''
+        evb1000_data._msg_fields = []
+
+        evb1000_data.msg_type_decoded = evb1000_data.decode_msg_type()
+        if not evb1000_data.msg_type_decoded:
+            raise InvalidDataFromEVB1000
+
+        evb1000_data._decoded = {'msg_type': msg_type}
+
+        return evb1000_data
+
     @property
     def msg_fields(self):
         return self._msg_fields
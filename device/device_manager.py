@@ -1,17 +1,16 @@
-# pyserial
+# pyserial, the tools required to list ports
+# are imported only by the DeviceManager
 import serial
-from serial.tools import list_ports
-from serial.tools.list_ports_common import ListPortInfo
 from serial.serialutil import SerialException
 
-# make ListPortInfo hashable
-def hash_fun(self):
-    return hash(str(self))
-ListPortInfo.__hash__ = hash_fun
-
 # multiprocessing
 import multiprocessing
-from ctypes import c_bool
+
+# stop watcher
+import threading
+
+# termination by a service manager
+import signal
 
 # sleep
 from time import sleep
@@ -30,11 +29,26 @@ from output.csv_logger import CSVLogger
 # csv required by class DeviceVIDPIDList
 import csv
 
-# import tqdm progress meter
-from output.tqdm_progress import TqdmProgress
+# latest state table
+from device.latest_state import LatestState
+from device.latest_state import DEFAULT_NAME as LATEST_STATE_NAME
+
+# startup time and memory report
+from device.process_stats import report_process_stats
 
 import time
 
+# maximum time spent in a blocking serial read, in seconds,
+# in case the read cannot be cancelled
+READ_TIMEOUT = 0.5
+
+# maximum time waited for devices to stop on their own, in seconds
+STOP_TIMEOUT = 5.0
+
+# maximum time waited for devices to terminate and
+# to be killed once STOP_TIMEOUT expired, in seconds
+KILL_TIMEOUT = 1.0
+
 class Device(multiprocessing.Process):
     """
     Represents an EVB1000 Tag connected through a serial port.
@@ -42,7 +56,8 @@ class Device(multiprocessing.Process):
     Inherits from Process to handle serial i/o operations
     in a separate process.
     """
-    def __init__(self, port, tqdm_position, tqdm_pos_lock):
+    def __init__(self, port, tqdm_position, tqdm_pos_lock, logger_factory=CSVLogger,\
+                 headless=False, latest_state_name=None, range_filter_factory=None):
         # call Process constructor
         multiprocessing.Process.__init__(self)
         
@@ -52,96 +67,187 @@ class Device(multiprocessing.Process):
         # configure device
         self.configure()
 
-        # set device state
-        self.running = multiprocessing.Value(c_bool, True)
-        self.running_lock = multiprocessing.Lock()
-        #self.running.value = True
+        # event set when the device has to stop
+        self.stop_event = multiprocessing.Event()
+
+        # process-local copy of the stop request, checked on every line
+        # without going through the lock of stop_event
+        self.stopping = False
 
         # set device id
         self.id = str(hash(self.port))
 
-        # instantiate a new csv logger
-        self.logger = CSVLogger()
+        # instantiate a new logger, e.g. a CSVLogger
+        self.logger = logger_factory()
+
+        # optional filter of outlying ranges, e.g. a RangeFilter
+        self.range_filter = None
+        if range_filter_factory is not None:
+            self.range_filter = range_filter_factory()
+
+        # name of the latest state table, attached when the process starts
+        self.latest_state_name = latest_state_name
+        self.latest_state = None
 
-        # tqdm progress meter
-        self.progress = TqdmProgress(tqdm_position,\
-                                     tqdm_pos_lock)
+        # tqdm progress meter, not used in headless mode
+        if headless:
+            self.progress = None
+        else:
+            # tqdm is imported only if required
+            from output.tqdm_progress import TqdmProgress
+            self.progress = TqdmProgress(tqdm_position,\
+                                         tqdm_pos_lock)
+
+    def start(self):
+        """
+        Start the device process.
+        """
+
+        # used to report the startup time of the process
+        self.started_at = time.time()
+
+        multiprocessing.Process.start(self)
 
     def __str__(self):
         return self.port.device
 
     @property
     def state(self):
-        self.running_lock.acquire()
-        value = self.running.value
-        self.running_lock.release()
-        
-        return value
-
-    @state.setter
-    def state(self, new_state):
-        self.running_lock.acquire()
-        self.running.value = new_state
-        self.running_lock.release()
+        return not self.stop_event.is_set()
 
     def stop_device(self):
         """
-        Change the running state of the device from True to False
+        Change the running state of the device from True to False.
+
+        The device process wakes up immediately, even if
+        blocked while reading from the serial port.
+        """
+
+        self.stop_event.set()
+
+    def watch_stop_event(self):
+        """
+        Wait for the stop event and cancel the pending serial read.
+
+        Runs on a thread of the device process.
+        """
+
+        self.stop_event.wait()
+
+        self.stopping = True
+
+        # wake up readline()
+        try:
+            self.serial.cancel_read()
+        except (AttributeError, SerialException):
+            # readline() will return within READ_TIMEOUT seconds
+            pass
+
+    def terminate_device(self, signum, frame):
+        """
+        Handle SIGTERM, e.g. sent by a service manager to every process
+        of the service, stopping as if stop_device() was called so that
+        the logs are closed.
         """
 
-        self.state = False
+        self.stopping = True
+
+        # wake up readline()
+        try:
+            self.serial.cancel_read()
+        except (AttributeError, SerialException):
+            pass
 
     def run(self):
         """
         Process main method.
         """
+        # stop gracefully when terminated
+        signal.signal(signal.SIGTERM, self.terminate_device)
+
+        # wake up the main loop as soon as the device is stopped
+        watcher = threading.Thread(target=self.watch_stop_event)
+        watcher.daemon = True
+        watcher.start()
+
+        # gracefully stop process if the connection is not working
         try:
-            # gracefully stop process if the connection is not working
             if not self.connect():
                 return
-        
-            while self.state:
+        except KeyboardInterrupt:
+            return
+
+        # attach to the latest state table owned by the manager
+        if self.latest_state_name is not None:
+            self.latest_state = LatestState.attach(self.latest_state_name)
+
+        report_process_stats('Device ' + str(self), self.started_at)
+
+        # bytes received since the last complete line
+        pending = b''
+
+        try:
+            while not self.stopping:
                 try:
                     # attempt reception of a new line
-                    line = self.serial.readline()
+                    pending += self.serial.readline()
+                except SerialException:
+                    # the port may have been disconnected, avoid spinning
+                    self.stop_event.wait(READ_TIMEOUT)
+                    continue
 
-                    # process only non null data
-                    if len(line) > 0:
+                # wait for the rest of lines cut by timeouts or cancellations
+                if not pending.endswith(b'\n'):
+                    continue
+                line = pending
+                pending = b''
 
-                        # decode last line received if possible
-                        try:
-                            evb1000_data = DataFromEVB1000(line)
-                        except InvalidDataFromEVB1000:
-                            # ignore this line
+                # decode last line received if possible
+                try:
+                    evb1000_data = DataFromEVB1000(line)
+                except InvalidDataFromEVB1000:
+                    # ignore this line
+                    continue
+
+                # continue only if message type was decoded successfully
+                if evb1000_data.msg_type_decoded:
+
+                    # filter ranges before logging and publishing
+                    if self.range_filter is not None:
+                        evb1000_data = self.range_filter.filter(evb1000_data)
+                        if evb1000_data is None:
                             continue
 
-                        # continue only if message type was decoded successfully
-                        if evb1000_data.msg_type_decoded:
-
-                            # log to file
-                            self.logger.log_data(evb1000_data)
-
-                            # update progress meter
-                            self.progress.new_message_event(evb1000_data)
+                    # log to file
+                    self.logger.log_data(evb1000_data)
 
-                except SerialException:
-                    pass
+                    # publish to the latest state table
+                    if self.latest_state is not None:
+                        self.latest_state.update(evb1000_data)
 
-                # greacefully stop process when the its state is set to False
-                if not self.state:
-                    # close csv file
-                    self.logger.close()
+                    # update progress meter
+                    if self.progress is not None:
+                        self.progress.new_message_event(evb1000_data)
 
-                    # free tqdm position
-                    self.progress.free_tqdm_position()
-            
-                    # stop thread
-                    self.close()
-                    
         except KeyboardInterrupt:
+            # the manager stops all the devices on its own
+            pass
+
+        finally:
             # close csv file
             self.logger.close()
 
+            # free tqdm position
+            if self.progress is not None:
+                self.progress.free_tqdm_position()
+
+            # detach from the latest state table
+            if self.latest_state is not None:
+                self.latest_state.close()
+
+            # close the serial port
+            self.close()
+
     def configure(self):
         """
         Get a serial.Serial instance and configure it.
@@ -156,6 +262,9 @@ class Device(multiprocessing.Process):
         # set baudrate
         self.serial.baudrate = 115200
 
+        # bound the time spent in readline()
+        self.serial.timeout = READ_TIMEOUT
+
     def connect(self):
         """
         Open the serial port.
@@ -166,10 +275,12 @@ class Device(multiprocessing.Process):
         # in Windows even if the device is detected it
         # may be not ready to be opened yet
         while not self.serial.is_open:
+            if self.stopping:
+                return False
             try:
                 self.serial.open()
             except SerialException:
-                pass
+                self.stop_event.wait(0.1)
             
         return True
 
@@ -266,12 +377,32 @@ class DeviceVIDPIDList:
             print('Error: No (VID, PID) entries found in ' + self.filename + '.')
             sys.exit(1)
               
+def join_devices(devices, timeout):
+    """
+    Join the processes of devices, waiting at most timeout seconds overall.
+    """
+
+    deadline = time.time() + timeout
+    for device in devices:
+        device.join(max(deadline - time.time(), 0))
+
+def make_list_port_info_hashable():
+    """
+    Make ListPortInfo hashable, as ports are used as dictionary keys.
+    """
+    from serial.tools.list_ports_common import ListPortInfo
+
+    def hash_fun(self):
+        return hash(str(self))
+    ListPortInfo.__hash__ = hash_fun
+
 class DeviceManager():
     """
     Manage EVB1000 devices connected through a serial port.
     """
     
-    def __init__(self, vid_pid_list):
+    def __init__(self, vid_pid_list, logger_factory=CSVLogger, headless=False,\
+                 latest_state_name=LATEST_STATE_NAME, range_filter_factory=None):
         # empty list of ports
         self.connected_ports = []
 
@@ -283,9 +414,24 @@ class DeviceManager():
         # empty list of *just* removed  devices
         self._removed_devices = []
 
+        # empty list of removed devices whose process is still alive
+        self.stopping_devices = []
+
         # store list of PIDs and VIDs of devices belonging to the EVB1000 system
         self.target_vid_pid = vid_pid_list.get_vid_pid_list()
 
+        # store the callable used by devices to create their logger
+        self.logger_factory = logger_factory
+
+        # in headless mode devices do not show progress meters
+        self.headless = headless
+
+        # store the callable used by devices to create their range filter, if any
+        self.range_filter_factory = range_filter_factory
+
+        # create the latest state table shared with devices and local readers
+        self.latest_state = LatestState.create(latest_state_name)
+
         # create a shared Value for tqdm progress meter positioning
         self.tqdm_position = multiprocessing.Value('i', 0)
         # create a Lock for the shared value
@@ -344,6 +490,9 @@ class DeviceManager():
                 # removed devices that were disconnected
                 self.removed_devices = self.remove_devices(removed_ports)
 
+            # join the processes of removed devices that already stopped
+            self.join_stopped_devices()
+
             # wait some time
             sleep(1)
 
@@ -362,7 +511,10 @@ class DeviceManager():
             # print('DeviceManager[' + time.strftime("%d-%m-%Y %H:%M:%S") +\
             #       ']: new device connected (port ' + str(p) + ')')
             
-            new_device = Device(p, self.tqdm_position, self.tqdm_pos_lock)
+            new_device = Device(p, self.tqdm_position, self.tqdm_pos_lock,\
+                                self.logger_factory, self.headless,\
+                                self.latest_state.shm.name,\
+                                self.range_filter_factory)
             self.configured_devices[new_device.id] = new_device
             new_devices.append(new_device)
             new_device.start()
@@ -388,25 +540,77 @@ class DeviceManager():
             
             # device id is defined as str(port.__hash__())
             device_id = str(hash(p))
-            self.configured_devices[device_id].stop_device()
+            removed_device = self.configured_devices[device_id]
+
+            # keep track of the process until it is joined, also
+            # if the manager is interrupted while removing devices
+            self.stopping_devices.append(removed_device)
+            removed_device.stop_device()
             
             # clean configured_devices dict
-            removed_device = self.configured_devices.pop(device_id)
+            self.configured_devices.pop(device_id)
             removed_devices.append(removed_device)
 
         return removed_devices
 
-    def stop_all_devices(self):
+    def join_stopped_devices(self):
+        """
+        Join the processes of removed devices that already stopped.
+        """
+
+        for device in list(self.stopping_devices):
+            if not device.is_alive():
+                device.join()
+                self.stopping_devices.remove(device)
+
+    def stop_all_devices(self, timeout=STOP_TIMEOUT):
         """
-        Stop all devices.
+        Stop all devices, including removed devices still stopping.
+
+        Devices are stopped in parallel. Processes still alive after
+        timeout seconds are terminated, then killed, so that the whole
+        procedure takes at most timeout + 2 * KILL_TIMEOUT seconds.
+        Processes that survive even that, e.g. blocked in uninterruptible
+        i/o, are reported and left behind.
         """
+        devices = list(self.configured_devices.values())
+        devices += [d for d in self.stopping_devices if not d in devices]
+
         # stop devices
-        for device_id in self.configured_devices:
-            self.configured_devices[device_id].stop_device()
+        for device in devices:
+            device.stop_device()
+
+        # wait for process end, sharing a single deadline
+        join_devices(devices, timeout)
+
+        # terminate processes that did not stop in time
+        stragglers = [d for d in devices if d.is_alive()]
+        for device in stragglers:
+            device.terminate()
+        join_devices(stragglers, KILL_TIMEOUT)
+
+        # kill processes that ignored the termination
+        stragglers = [d for d in stragglers if d.is_alive()]
+        for device in stragglers:
+            device.kill()
+        join_devices(stragglers, KILL_TIMEOUT)
+
+        for device in stragglers:
+            if device.is_alive():
+                sys.stderr.write('DeviceManager[' + time.strftime("%d-%m-%Y %H:%M:%S") +\
+                                 ']: device ' + str(device) + ' (pid ' + str(device.pid) +\
+                                 ') could not be stopped\n')
+
+        self.configured_devices = dict()
+        self.stopping_devices = []
 
-        # wait for thread end
-        for device_id in self.configured_devices:
-            self.configured_devices[device_id].join()
+    def close(self):
+        """
+        Stop all devices and destroy the latest state table.
+        """
+
+        self.stop_all_devices()
+        self.latest_state.close()
 
 
     def update_ports(self):
@@ -421,6 +625,10 @@ class DeviceManager():
         Return a list containing removed ports.
         """
         
+        # pyserial tools are imported only if required
+        from serial.tools import list_ports
+        make_list_port_info_hashable()
+
         # fetch only those ports having
         # VID:PID == a valid (VID, PID) pair in target_vid_pid
         ports = []
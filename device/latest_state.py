@@ -0,0 +1,291 @@
+import os
+import sys
+import time
+import struct
+
+# shared memory
+from multiprocessing import shared_memory
+
+# default name of the shared memory block
+DEFAULT_NAME = 'evb1000_latest_state'
+
+# maximum device id stored by default, ids are decoded from a single byte
+DEFAULT_MAX_IDS = 256
+
+# tables stored in the shared memory block, one for each message type,
+# with the fields of the last message received for each device id
+TABLES = [('tpr', ['x', 'y', 'z']),
+          ('trr', ['r0', 'r1', 'r2', 'r3']),
+          ('apr', ['a0_x', 'a0_y', 'a0_z',
+                   'a1_x', 'a1_y', 'a1_z',
+                   'a2_x', 'a2_y', 'a2_z',
+                   'a3_x', 'a3_y', 'a3_z']),
+          ('arr', ['master_id', 'src_id', 'dest_id', 'range'])]
+
+# every row starts with the sequence number and the timestamp
+ROW_HEADER = 2
+
+# the block starts with a header storing max_ids and the pid of the owner
+BLOCK_HEADER = 2
+
+# maximum number of attempts of a read racing with a write,
+# and delay between attempts, in seconds
+MAX_READ_ATTEMPTS = 1000
+READ_RETRY_DELAY = 0.0001
+
+class ConcurrentUpdate(Exception):
+    pass
+
+class LatestState:
+    """
+    Table of the last message received for each message type and device id,
+    e.g. the last position of each tag, stored in shared memory.
+
+    The table is an array of doubles indexed by message type and device id,
+    so that updates and lookups take constant time. Every row is protected
+    by a sequence number (seqlock): the writer makes it odd while updating
+    the row and even when done, readers retry if the number is odd or changed
+    while reading. Readers therefore never block the writers.
+
+    Each row is expected to be written by a single writer, i.e. a device
+    id should be reported through a single serial port. Threads sharing
+    a LatestState, e.g. the handlers of the aggregator, must serialize
+    their calls to update().
+    """
+
+    def __init__(self, shm, max_ids, owner=False):
+
+        # save shared memory
+        self.shm = shm
+        self.max_ids = max_ids
+        self.owner = owner
+
+        # view of the block as an array of doubles
+        self.values = shm.buf.cast('d')
+
+        # offset and width of the rows of each table
+        self.tables = dict()
+        offset = BLOCK_HEADER
+        for msg_type, fields in TABLES:
+            width = ROW_HEADER + len(fields)
+            self.tables[msg_type] = (offset, width, fields)
+            offset = offset + width * max_ids
+
+    @staticmethod
+    def size(max_ids):
+        """
+        Return the size in bytes of the block.
+        """
+        doubles = BLOCK_HEADER
+        for msg_type, fields in TABLES:
+            doubles = doubles + (ROW_HEADER + len(fields)) * max_ids
+
+        return doubles * struct.calcsize('d')
+
+    @classmethod
+    def create(cls, name=DEFAULT_NAME, max_ids=DEFAULT_MAX_IDS):
+        """
+        Create the shared memory block, replacing a stale one.
+
+        Exit if the block is owned by a running process.
+        """
+
+        size = cls.size(max_ids)
+
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # the block is in use, e.g. by another collector or aggregator
+            existing = untracked_shared_memory(name)
+            values = existing.buf.cast('d')
+            pid = int(values[1])
+            values.release()
+            existing.close()
+
+            if process_alive(pid):
+                print('Error: latest state table ' + name + ' is in use by process ' +\
+                      str(pid) + ', use --state-name to choose another name.')
+                sys.exit(1)
+
+            # left behind by a collector that crashed
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        state = cls(shm, max_ids, owner=True)
+        state.values[0] = max_ids
+        state.values[1] = os.getpid()
+
+        return state
+
+    @classmethod
+    def attach(cls, name=DEFAULT_NAME, track=True):
+        """
+        Attach to an existing shared memory block.
+
+        Processes not started by the collector should use track=False,
+        otherwise the block is destroyed when they exit.
+        """
+
+        if track:
+            shm = shared_memory.SharedMemory(name=name)
+        else:
+            shm = untracked_shared_memory(name)
+
+        max_ids = int(shm.buf.cast('d')[0])
+
+        return cls(shm, max_ids)
+
+    def row(self, msg_type, device_id):
+        """
+        Return the index of the row and the table description
+        for msg_type and device_id.
+        """
+
+        offset, width, fields = self.tables[msg_type]
+
+        if device_id < 0 or device_id >= self.max_ids:
+            raise IndexError('Device id ' + str(device_id) + ' out of range.')
+
+        return offset + device_id * width, width, fields
+
+    def update(self, evb1000_data):
+        """
+        Store the decoded message, if its type is stored in the table.
+        """
+
+        data = evb1000_data.decoded
+        msg_type = data['msg_type']
+
+        if not msg_type in self.tables:
+            return
+
+        try:
+            index, width, fields = self.row(msg_type, data['id'])
+        except IndexError:
+            return
+
+        values = self.values
+        seq = values[index]
+
+        # odd sequence number, write in progress
+        values[index] = seq + 1
+
+        values[index + 1] = evb1000_data.timestamp
+        for i, field in enumerate(fields):
+            values[index + ROW_HEADER + i] = data[field]
+
+        # even sequence number, write completed
+        values[index] = seq + 2
+
+    def get(self, msg_type, device_id):
+        """
+        Return a dictionary with the timestamp and the fields of the last
+        message of type msg_type received from device_id, or None if
+        no message was received.
+
+        Raise ConcurrentUpdate if the row was being written during every
+        attempt, e.g. because its writer died while updating it.
+        """
+
+        index, width, fields = self.row(msg_type, device_id)
+        values = self.values
+
+        for attempt in range(MAX_READ_ATTEMPTS):
+            seq = values[index]
+
+            # write in progress
+            if seq % 2 == 1:
+                time.sleep(READ_RETRY_DELAY)
+                continue
+
+            row = values[index + 1:index + width].tolist()
+
+            # the row did not change while reading
+            if values[index] == seq:
+                if seq == 0:
+                    return None
+
+                result = dict(zip(fields, row[1:]))
+                result['timestamp'] = row[0]
+                result['id'] = device_id
+
+                return result
+
+        raise ConcurrentUpdate
+
+    def close(self):
+        """
+        Detach from the shared memory block, destroying it if owned.
+        """
+
+        self.values.release()
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
+
+def process_alive(pid):
+    """
+    Return True if the process pid is running.
+    """
+
+    if pid <= 0:
+        return False
+
+    # on Windows a block is destroyed with the last process using it,
+    # hence an existing block is always in use
+    if sys.platform == 'win32':
+        return True
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # running, owned by another user
+        return True
+
+    return True
+
+def untracked_shared_memory(name):
+    """
+    Attach to the shared memory block name without registering it
+    to the resource tracker, that would destroy it at exit.
+    """
+
+    # available since Python 3.13
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+
+    shm = shared_memory.SharedMemory(name=name)
+
+    if sys.platform != 'win32':
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+
+    return shm
+
+if __name__ == '__main__':
+    # print the last message of a given type received from a device, e.g.
+    # python -m device.latest_state tpr 2
+    if len(sys.argv) < 3:
+        print('Usage: python -m device.latest_state <msg_type> <device_id> [name]')
+        sys.exit(1)
+
+    name = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_NAME
+
+    try:
+        state = LatestState.attach(name, track=False)
+    except FileNotFoundError:
+        print('Error: latest state table ' + name + ' not found, is the collector running?')
+        sys.exit(1)
+
+    try:
+        print(state.get(sys.argv[1], int(sys.argv[2])))
+    except ConcurrentUpdate:
+        print('Error: the row is being updated, try again.')
+    state.close()
@@ -0,0 +1,46 @@
+import os
+import sys
+import time
+
+def resident_memory():
+    """
+    Return the resident memory of the current process in kilobytes,
+    or None if it cannot be determined on this platform.
+    """
+
+    # current resident set size on Linux
+    try:
+        with open('/proc/self/statm', 'r') as fd:
+            pages = int(fd.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, IOError, ValueError, AttributeError):
+        pass
+
+    # peak resident set size on other Unix systems
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        max_rss = max_rss // 1024
+
+    return max_rss
+
+def report_process_stats(name, started_at):
+    """
+    Print the startup time, measured from started_at, and
+    the resident memory of the current process.
+    """
+
+    elapsed = (time.time() - started_at) * 1000
+
+    rss = resident_memory()
+    rss = 'n/a' if rss is None else '%.1f MB' % (rss / 1024.0)
+
+    sys.stderr.write(name + '[pid ' + str(os.getpid()) + ']: ready in ' +\
+                     '%.1f ms' % elapsed + ', resident memory ' + rss + '\n')
+    sys.stderr.flush()
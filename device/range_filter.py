@@ -0,0 +1,161 @@
+# numpy is required only if ranges are filtered
+import numpy as np
+
+# fields containing ranges for each message type
+RANGE_FIELDS = {'trr': ['r0', 'r1', 'r2', 'r3'],
+                'arr': ['range']}
+
+# minimum deviation used to reject outliers, ranges are reported
+# in millimeters by 'trr' messages and in meters by 'arr' messages
+MIN_DEVIATION = {'trr': 10.0,
+                 'arr': 0.01}
+
+# scale factor relating the MAD to the standard deviation of normal data
+MAD_SCALE = 1.4826
+
+class RangeFilter:
+    """
+    Reject outliers, e.g. non-line-of-sight spikes and zero values,
+    from the ranges of 'trr' and 'arr' messages.
+
+    The last window ranges of each link, i.e. each (tag, anchor) pair for
+    'trr' messages and each (source, destination) pair for 'arr' messages,
+    are stored in a preallocated ring buffer. A range is an outlier if it
+    is zero or if its distance from the median of the window is larger than
+    threshold times the scaled median absolute deviation (MAD). All the
+    ranges of a message are checked at once.
+
+    With mode 'flag' the field 'outliers' is added to the message, a bitmask
+    with bit i set if the i-th range is an outlier. With mode 'drop' outlying
+    'trr' ranges are set to 0, i.e. the value reported by the device for
+    missing ranges, and 'arr' messages with an outlying range are dropped.
+    """
+
+    def __init__(self, mode='flag', window=15, threshold=3.5,\
+                 min_samples=5, max_links=4096):
+
+        if not mode in ['flag', 'drop']:
+            raise ValueError('Unknown filter mode ' + str(mode) + '.')
+
+        # save configuration
+        self.mode = mode
+        self.window = window
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.max_links = max_links
+
+        # ring buffers, one row for each link, NaN if empty
+        self.windows = np.full((max_links, window), np.nan)
+
+        # number of ranges received for each link
+        self.counts = np.zeros(max_links, dtype=np.int64)
+
+        # map from (msg_type, id, link) to row of the ring buffers
+        self.links = dict()
+
+    def link_rows(self, msg_type, data):
+        """
+        Return the rows of the ring buffers of the links in the message,
+        or None if no more links can be stored.
+        """
+
+        if msg_type == 'trr':
+            keys = [(msg_type, data['id'], i) for i in range(4)]
+        else:
+            keys = [(msg_type, data['src_id'], data['dest_id'])]
+
+        rows = []
+        for key in keys:
+            try:
+                rows.append(self.links[key])
+            except KeyError:
+                if len(self.links) >= self.max_links:
+                    return None
+                self.links[key] = len(self.links)
+                rows.append(self.links[key])
+
+        return np.array(rows)
+
+    def outliers(self, rows, ranges, min_deviation):
+        """
+        Return a boolean array, True for ranges that are outliers
+        with respect to the windows of rows, whose deviation
+        is at least min_deviation.
+
+        The ranges are then stored in the windows.
+        """
+
+        windows = self.windows[rows]
+
+        # number of samples in each window and position of the
+        # middle samples once sorted, NaNs are sorted last
+        samples = np.minimum(self.counts[rows], self.window)
+        lower = np.maximum(samples - 1, 0) // 2
+        upper = samples // 2
+        index = np.arange(len(rows))
+
+        with np.errstate(all='ignore'):
+            # median of each window
+            ordered = np.sort(windows, axis=1)
+            median = 0.5 * (ordered[index, lower] + ordered[index, upper])
+
+            # median absolute deviation of each window
+            ordered = np.sort(np.abs(windows - median[:, None]), axis=1)
+            mad = 0.5 * (ordered[index, lower] + ordered[index, upper])
+            deviation = np.maximum(MAD_SCALE * mad, min_deviation)
+
+            # check only the windows containing enough samples
+            ready = samples >= self.min_samples
+            spike = ready & (np.abs(ranges - median) > self.threshold * deviation)
+
+        outliers = (ranges == 0) | spike
+
+        # store the non zero ranges in the ring buffers
+        valid = ranges != 0
+        valid_rows = rows[valid]
+        self.windows[valid_rows, self.counts[valid_rows] % self.window] = ranges[valid]
+        self.counts[valid_rows] += 1
+
+        return outliers
+
+    def filter(self, evb1000_data):
+        """
+        Filter the ranges of the message.
+
+        Return the message, possibly modified, or None if it has to be dropped.
+        """
+
+        data = evb1000_data.decoded
+        msg_type = data['msg_type']
+
+        if not msg_type in RANGE_FIELDS:
+            return evb1000_data
+
+        fields = RANGE_FIELDS[msg_type]
+
+        # links that cannot be stored are never flagged, yet in flag mode
+        # every message gets the column so that files have a single header
+        rows = self.link_rows(msg_type, data)
+        if rows is None:
+            outliers = np.zeros(len(fields), dtype=bool)
+        else:
+            ranges = np.array([data[field] for field in fields], dtype=np.float64)
+            outliers = self.outliers(rows, ranges, MIN_DEVIATION[msg_type])
+
+        if self.mode == 'flag':
+            bitmask = 0
+            for i, outlier in enumerate(outliers):
+                if outlier:
+                    bitmask |= 1 << i
+            evb1000_data.msg_fields = evb1000_data.msg_fields + ['outliers']
+            data['outliers'] = bitmask
+
+        elif msg_type == 'trr':
+            for i, outlier in enumerate(outliers):
+                if outlier:
+                    data[fields[i]] = 0
+
+        elif outliers.any():
+            return None
+
+        return evb1000_data
@@ -0,0 +1,146 @@
+import sys
+import time
+import socket
+import threading
+import socketserver
+
+# binary framing
+from network.protocol import HANDSHAKE
+from network.protocol import MAGIC
+from network.protocol import VERSION
+from network.protocol import BATCH_HEADER
+from network.protocol import MAX_BATCH_SIZE
+from network.protocol import MalformedStream
+from network.protocol import decode_batch
+
+class GatewayHandler(socketserver.StreamRequestHandler):
+    """
+    Receive the messages forwarded by a gateway device
+    and feed them to the aggregator pipeline.
+    """
+
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.server.add_connection(self.request)
+
+    def finish(self):
+        self.server.remove_connection(self.request)
+        socketserver.StreamRequestHandler.finish(self)
+
+    def handle(self):
+
+        # read the handshake
+        header = self.rfile.read(HANDSHAKE.size)
+        if len(header) < HANDSHAKE.size:
+            return
+        magic, version, length = HANDSHAKE.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            return
+        self.gateway_name = self.rfile.read(length).decode('utf-8', 'replace')
+
+        # each forwarding device gets its own logger, as a local device
+        logger = self.server.logger_factory()
+
+        try:
+            while True:
+                header = self.rfile.read(BATCH_HEADER.size)
+                if len(header) < BATCH_HEADER.size:
+                    break
+
+                # drop gateways announcing batches longer than any valid one,
+                # instead of allocating the announced length
+                length, = BATCH_HEADER.unpack(header)
+                if length > MAX_BATCH_SIZE:
+                    sys.stderr.write('Aggregator[' + time.strftime("%d-%m-%Y %H:%M:%S") +\
+                                     ']: batch of ' + str(length) + ' bytes from ' +\
+                                     self.gateway_name + ', closing the connection\n')
+                    break
+
+                payload = self.rfile.read(length)
+                if len(payload) < length:
+                    break
+
+                try:
+                    records = decode_batch(payload)
+                except MalformedStream:
+                    break
+
+                for evb1000_data in records:
+                    self.server.process(logger, evb1000_data)
+
+        finally:
+            logger.close()
+
+class Aggregator(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    Accept connections from many gateways forwarding decoded messages,
+    log them and publish them to the latest state table, if any.
+    """
+
+    allow_reuse_address = True
+
+    # wait for connections to close their loggers on server_close()
+    daemon_threads = False
+    block_on_close = True
+
+    def __init__(self, address, logger_factory, latest_state=None):
+
+        socketserver.TCPServer.__init__(self, address, GatewayHandler)
+
+        # store the callable used to create the logger of each connection
+        self.logger_factory = logger_factory
+
+        # latest state table shared with local readers, updated by one
+        # connection at a time since a row may be reported by several gateways
+        self.latest_state = latest_state
+        self.latest_state_lock = threading.Lock()
+
+        # number of messages received
+        self.received = 0
+
+        # open connections
+        self.connections = set()
+        self.connections_lock = threading.Lock()
+
+    def add_connection(self, sock):
+        with self.connections_lock:
+            self.connections.add(sock)
+
+    def remove_connection(self, sock):
+        with self.connections_lock:
+            self.connections.discard(sock)
+
+    def close(self):
+        """
+        Stop accepting connections, close the open ones
+        and wait for their loggers to be closed.
+
+        Must not be called from the thread running serve_forever().
+        """
+
+        self.shutdown()
+
+        with self.connections_lock:
+            for sock in self.connections:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        self.server_close()
+
+    def process(self, logger, evb1000_data):
+        """
+        Log and publish a message received from a gateway.
+        """
+
+        # log to file
+        logger.log_data(evb1000_data)
+
+        # publish to the latest state table
+        if self.latest_state is not None:
+            with self.latest_state_lock:
+                self.latest_state.update(evb1000_data)
+
+        # approximate, connections update it concurrently
+        self.received = self.received + 1
@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import socket
+import select
+import threading
+from collections import deque
+
+# binary framing
+from network.protocol import encode_handshake
+from network.protocol import encode_record
+from network.protocol import encode_batch
+from network.protocol import MAX_BATCH_SIZE
+
+class Forwarder:
+    """
+    Forward decoded messages to an aggregator over TCP.
+
+    Offers the same interface of CSVLogger, so that it can replace the
+    logger of a device. Messages are encoded by the caller and buffered,
+    while a background thread sends them in batches and reconnects when
+    the connection is lost. At most max_buffered messages are kept while
+    disconnected, the oldest ones are discarded first.
+    """
+
+    def __init__(self, host, port, gateway_name=None, max_buffered=100000,\
+                 batch_size=512, flush_interval=0.05, close_timeout=2.0):
+
+        # save configuration
+        self.address = (host, port)
+        self.gateway_name = gateway_name if gateway_name else socket.gethostname()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.close_timeout = close_timeout
+
+        # encoded messages waiting to be sent, bounded
+        self.buffer = deque(maxlen=max_buffered)
+
+        # number of messages discarded because the buffer was full,
+        # and number of them already reported
+        self.dropped = 0
+        self.reported = 0
+
+        # batch being sent, kept until it is transmitted so that
+        # it is sent again after reconnecting, and its number of records
+        self.unsent = None
+        self.unsent_count = 0
+
+        # the sender thread is created on the first message so that
+        # the forwarder can be built before the device process is started
+        self.sender = None
+        self.wakeup = threading.Event()
+        self.closing = threading.Event()
+        self.close_deadline = None
+
+    def log_data(self, evb1000_data):
+        """
+        Queue a new message for forwarding.
+        """
+
+        record = encode_record(evb1000_data)
+        if record is None:
+            return
+
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped = self.dropped + 1
+        self.buffer.append(record)
+
+        if self.sender is None:
+            self.sender = threading.Thread(target=self.send_loop)
+            self.sender.daemon = True
+            self.sender.start()
+
+        if len(self.buffer) >= self.batch_size:
+            self.wakeup.set()
+
+    def connect(self):
+        """
+        Connect to the aggregator, retrying with increasing delays.
+
+        Return the socket or None if the forwarder was closed
+        and close_timeout expired.
+        """
+
+        delay = 0.1
+
+        while True:
+            try:
+                sock = socket.create_connection(self.address, timeout=5.0)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.sendall(encode_handshake(self.gateway_name + ':' + str(os.getpid())))
+                self.report_dropped()
+                return sock
+            except OSError:
+                pass
+
+            # keep retrying while closing, so that the buffered
+            # messages are sent if the aggregator is back in time
+            if self.closing.is_set():
+                remaining = self.close_deadline - time.time()
+                if remaining <= 0:
+                    return None
+                time.sleep(min(delay, remaining))
+            else:
+                self.closing.wait(delay)
+            delay = min(delay * 2, 5.0)
+
+    def report_dropped(self):
+        """
+        Report the messages discarded since the last report.
+        """
+
+        dropped = self.dropped
+        if dropped == self.reported:
+            return
+
+        sys.stderr.write('Forwarder[' + time.strftime("%d-%m-%Y %H:%M:%S") + ']: ' +\
+                         str(dropped - self.reported) + ' messages for ' +\
+                         self.address[0] + ':' + str(self.address[1]) +\
+                         ' discarded, ' + str(dropped) + ' in total\n')
+        self.reported = dropped
+
+    def next_batch(self):
+        """
+        Return the next batch to be sent, or None if there is nothing to send.
+        """
+
+        if self.unsent is not None:
+            return self.unsent
+
+        # the batch is bounded by the number of records and by
+        # the length accepted by the aggregator
+        records = []
+        size = 0
+        try:
+            while len(records) < self.batch_size:
+                if size + len(self.buffer[0]) > MAX_BATCH_SIZE:
+                    break
+                record = self.buffer.popleft()
+                records.append(record)
+                size = size + len(record)
+        except IndexError:
+            pass
+
+        if not records:
+            return None
+
+        self.unsent = encode_batch(records)
+        self.unsent_count = len(records)
+
+        return self.unsent
+
+    def send_loop(self):
+        """
+        Send batches to the aggregator.
+
+        Runs on a background thread.
+        """
+
+        sock = None
+
+        while True:
+            if sock is None:
+                sock = self.connect()
+                if sock is None:
+                    return
+
+            batch = self.next_batch()
+
+            if batch is None:
+                if self.closing.is_set():
+                    break
+
+                # wait for a full batch or for the flush interval
+                self.wakeup.wait(self.flush_interval)
+                self.wakeup.clear()
+                continue
+
+            try:
+                # the aggregator never sends data, a readable socket
+                # means that the connection was closed by the aggregator
+                if select.select([sock], [], [], 0)[0]:
+                    raise ConnectionResetError
+
+                sock.sendall(batch)
+                self.unsent = None
+            except OSError:
+                # keep the batch and reconnect
+                sock.close()
+                sock = None
+
+        sock.close()
+
+    def close(self):
+        """
+        Send the buffered messages, waiting at most close_timeout seconds,
+        and report the messages that were discarded.
+        """
+
+        self.close_deadline = time.time() + self.close_timeout
+        self.closing.set()
+        self.wakeup.set()
+
+        if self.sender is not None:
+            self.sender.join(self.close_timeout)
+
+        # messages not sent in time are lost as well
+        self.dropped = self.dropped + len(self.buffer)
+        if self.unsent is not None:
+            self.dropped = self.dropped + self.unsent_count
+        self.report_dropped()
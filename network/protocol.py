@@ -0,0 +1,149 @@
+import struct
+
+# EVB1000 decoder
+from device.decoder import DataFromEVB1000
+from device.decoder import InvalidDataFromEVB1000
+
+# handshake sent by a gateway when it connects: magic, version
+# and length of the name of the gateway, followed by the name
+HANDSHAKE = struct.Struct('<4sBB')
+MAGIC = b'EVBF'
+VERSION = 1
+
+# every batch of records is preceded by its length
+BATCH_HEADER = struct.Struct('<I')
+
+# maximum length of a batch, longer batches are
+# never sent by a gateway nor accepted by the aggregator
+MAX_BATCH_SIZE = 1024 * 1024
+
+# every record starts with its type, its flags and its timestamp
+RECORD_HEADER = struct.Struct('<BBd')
+
+# codes of the message types
+TYPE_CODES = {'tpr': 1, 'apr': 2, 'arr': 3, 'trr': 4}
+TYPE_NAMES = dict((code, name) for name, code in TYPE_CODES.items())
+
+# record flags
+FLAG_OUTLIERS = 0x01
+
+# struct format of each numeric field type of the decoder
+FIELD_FORMATS = {'u': 'I', 'f': 'f'}
+
+# length of the strings
+STRING_LENGTH = struct.Struct('<B')
+
+# outliers bitmask added by the range filter
+OUTLIERS = struct.Struct('<B')
+
+class MalformedStream(Exception):
+    pass
+
+class RecordLayout:
+    """
+    Binary layout of a message type.
+
+    Numeric fields are packed together, as unsigned ints or 32 bit floats
+    as sent by the EVB1000, and followed by the length prefixed string fields.
+    """
+
+    def __init__(self, msg_type):
+
+        # obtain fields and their types from the decoder
+        template = DataFromEVB1000.from_decoded(msg_type, 0.0)
+
+        fields = list(zip(template.msg_fields, template.msg_structure))[1:]
+
+        self.numeric_fields = [f for f, t in fields if t != 's']
+        self.string_fields = [f for f, t in fields if t == 's']
+        self.numeric = struct.Struct('<' + ''.join([FIELD_FORMATS[t] for f, t in fields\
+                                                    if t != 's']))
+
+# layouts of the message types
+LAYOUTS = dict((name, RecordLayout(name)) for name in TYPE_CODES)
+
+def encode_handshake(gateway_name):
+    """
+    Return the handshake sent by gateway_name.
+    """
+    name = gateway_name.encode('utf-8')[:255]
+
+    return HANDSHAKE.pack(MAGIC, VERSION, len(name)) + name
+
+def encode_record(evb1000_data):
+    """
+    Return the binary representation of the decoded message,
+    or None if its type cannot be forwarded.
+    """
+
+    data = evb1000_data.decoded
+    msg_type = data['msg_type']
+
+    try:
+        layout = LAYOUTS[msg_type]
+    except KeyError:
+        return None
+
+    flags = FLAG_OUTLIERS if 'outliers' in data else 0
+
+    parts = [RECORD_HEADER.pack(TYPE_CODES[msg_type], flags, evb1000_data.timestamp),\
+             layout.numeric.pack(*[data[f] for f in layout.numeric_fields])]
+
+    for field in layout.string_fields:
+        value = data[field].encode('utf-8')[:255]
+        parts.append(STRING_LENGTH.pack(len(value)))
+        parts.append(value)
+
+    if flags & FLAG_OUTLIERS:
+        parts.append(OUTLIERS.pack(data['outliers']))
+
+    return b''.join(parts)
+
+def encode_batch(records):
+    """
+    Return a batch made of the encoded records.
+    """
+    payload = b''.join(records)
+
+    return BATCH_HEADER.pack(len(payload)) + payload
+
+def decode_batch(payload):
+    """
+    Return the list of messages, as DataFromEVB1000, contained in payload.
+    """
+
+    records = []
+    offset = 0
+
+    try:
+        while offset < len(payload):
+            code, flags, timestamp = RECORD_HEADER.unpack_from(payload, offset)
+            offset = offset + RECORD_HEADER.size
+
+            msg_type = TYPE_NAMES[code]
+            layout = LAYOUTS[msg_type]
+
+            evb1000_data = DataFromEVB1000.from_decoded(msg_type, timestamp)
+            data = evb1000_data.decoded
+
+            values = layout.numeric.unpack_from(payload, offset)
+            offset = offset + layout.numeric.size
+            data.update(zip(layout.numeric_fields, values))
+
+            for field in layout.string_fields:
+                length, = STRING_LENGTH.unpack_from(payload, offset)
+                offset = offset + STRING_LENGTH.size
+                data[field] = payload[offset:offset + length].decode('utf-8')
+                offset = offset + length
+
+            if flags & FLAG_OUTLIERS:
+                data['outliers'], = OUTLIERS.unpack_from(payload, offset)
+                offset = offset + OUTLIERS.size
+                evb1000_data.msg_fields = evb1000_data.msg_fields + ['outliers']
+
+            records.append(evb1000_data)
+
+    except (struct.error, KeyError, UnicodeDecodeError, InvalidDataFromEVB1000):
+        raise MalformedStream
+
+    return records
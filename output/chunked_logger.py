@@ -0,0 +1,318 @@
+import io
+import os
+import csv
+import sys
+import time
+import zlib
+import struct
+
+# base logger
+from output.file_logger import FileLogger
+
+# chunk header: magic, length of the compressed payload
+CHUNK_HEADER = struct.Struct('<4sI')
+CHUNK_MAGIC = b'EVBC'
+
+# index entry: earliest timestamp, latest timestamp,
+# byte offset of the chunk header, length of the payload, number of records
+INDEX_ENTRY = struct.Struct('<ddQII')
+
+class MalformedChunkedLog(Exception):
+    pass
+
+class ChunkedLogWriter:
+    """
+    Write records to a container made of independently compressed chunks.
+
+    Each chunk is the zlib compressed csv text of up to chunk_records
+    records, header included, so that every chunk can be decoded on its own.
+    The location of every chunk is appended to a sidecar index file,
+    <filename>.idx, that maps the chunk to its earliest and latest
+    timestamps, byte offset and record count.
+    """
+
+    def __init__(self, filename, fields, chunk_records=1000, chunk_interval=60.0):
+
+        # save configuration
+        self.filename = filename
+        self.fields = ['timestamp'] + list(fields)
+        self.chunk_records = chunk_records
+        self.chunk_interval = chunk_interval
+
+        # files are opened in append mode so that a newly
+        # connected tag with the same id logs in the same container
+        self.data_fd = open(filename, 'ab')
+        self.index_fd = open(filename + '.idx', 'ab')
+
+        # empty pending chunk
+        self.reset_chunk()
+
+    def reset_chunk(self):
+        """
+        Start a new pending chunk.
+        """
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+        self.writer.writerow(self.fields)
+        self.count = 0
+        self.min_ts = None
+        self.max_ts = None
+        self.started_at = time.time()
+
+    def write(self, timestamp, values):
+        """
+        Append a record to the pending chunk and flush it if full.
+        """
+
+        self.writer.writerow([repr(timestamp)] + list(values))
+
+        # the clock may be stepped backwards, e.g. by NTP,
+        # hence the first timestamp is not always the earliest
+        if self.min_ts is None:
+            self.min_ts = timestamp
+            self.max_ts = timestamp
+        self.min_ts = min(self.min_ts, timestamp)
+        self.max_ts = max(self.max_ts, timestamp)
+        self.count = self.count + 1
+
+        if self.count >= self.chunk_records or\
+           time.time() - self.started_at >= self.chunk_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Compress the pending chunk, write it and update the index.
+        """
+
+        if self.count == 0:
+            return
+
+        payload = zlib.compress(self.buffer.getvalue().encode('utf-8'))
+
+        # the data file is opened in append mode, hence
+        # the chunk is written at the end of the file
+        self.data_fd.seek(0, os.SEEK_END)
+        offset = self.data_fd.tell()
+        self.data_fd.write(CHUNK_HEADER.pack(CHUNK_MAGIC, len(payload)))
+        self.data_fd.write(payload)
+        self.data_fd.flush()
+
+        # index the chunk only after it is completely written
+        self.index_fd.write(INDEX_ENTRY.pack(self.min_ts, self.max_ts,\
+                                             offset, len(payload), self.count))
+        self.index_fd.flush()
+
+        self.reset_chunk()
+
+    def close(self):
+        """
+        Flush the pending chunk and close the files.
+        """
+        self.flush()
+        self.data_fd.close()
+        self.index_fd.close()
+
+class ChunkedLogReader:
+    """
+    Read records from a container written by ChunkedLogWriter.
+
+    Only the chunks overlapping the requested time range are decompressed.
+    """
+
+    def __init__(self, filename):
+
+        # save filename
+        self.filename = filename
+
+        # load the index, or rebuild it scanning the container
+        try:
+            self.index = self.load_index()
+        except (OSError, IOError, MalformedChunkedLog):
+            self.index = []
+
+        # index the chunks missing from the index, e.g. because the writer
+        # was killed between writing a chunk and its entry, found in the
+        # gaps between the entries and after the last one
+        index = []
+        end = 0
+        for entry in self.index:
+            if entry[2] > end:
+                index = index + self.scan_index(end, entry[2])
+            index.append(entry)
+            end = entry[2] + CHUNK_HEADER.size + entry[3]
+        if os.path.getsize(self.filename) > end:
+            index = index + self.scan_index(end)
+        self.index = index
+
+    def load_index(self):
+        """
+        Load the sidecar index.
+
+        Return a list of (min_ts, max_ts, offset, length, count) tuples.
+        """
+
+        with open(self.filename + '.idx', 'rb') as fd:
+            data = fd.read()
+
+        # ignore a truncated trailing entry
+        size = len(data) - len(data) % INDEX_ENTRY.size
+
+        return [entry for entry in INDEX_ENTRY.iter_unpack(data[:size])]
+
+    def scan_index(self, start=0, stop=None):
+        """
+        Rebuild the index decompressing the chunks of the container
+        between the byte offsets start and stop, None meaning the end of the file.
+
+        Return a list of (min_ts, max_ts, offset, length, count) tuples.
+        """
+
+        index = []
+
+        with open(self.filename, 'rb') as fd:
+            fd.seek(start)
+            while True:
+                offset = fd.tell()
+                if stop is not None and offset >= stop:
+                    break
+                header = fd.read(CHUNK_HEADER.size)
+
+                # stop at the end of the file or at a truncated chunk
+                if len(header) < CHUNK_HEADER.size:
+                    break
+                magic, length = CHUNK_HEADER.unpack(header)
+                if magic != CHUNK_MAGIC:
+                    break
+                payload = fd.read(length)
+                if len(payload) < length:
+                    break
+
+                # a chunk cut by a crash cannot be recovered,
+                # nor can the chunks following it
+                try:
+                    rows = self.decode_chunk(payload)
+                except (zlib.error, UnicodeDecodeError):
+                    break
+                if rows:
+                    timestamps = [float(row['timestamp']) for row in rows]
+                    index.append((min(timestamps), max(timestamps),\
+                                  offset, length, len(rows)))
+
+        return index
+
+    def decode_chunk(self, payload):
+        """
+        Return the list of records, as dictionaries, stored in payload.
+        """
+        text = zlib.decompress(payload).decode('utf-8')
+
+        return list(csv.DictReader(io.StringIO(text)))
+
+    def read_chunk(self, fd, entry):
+        """
+        Return the records stored in the chunk described by the index entry.
+        """
+
+        offset, length = entry[2], entry[3]
+
+        fd.seek(offset)
+        magic, _ = CHUNK_HEADER.unpack(fd.read(CHUNK_HEADER.size))
+        if magic != CHUNK_MAGIC:
+            raise MalformedChunkedLog
+
+        return self.decode_chunk(fd.read(length))
+
+    def read(self, start=None, end=None):
+        """
+        Return the records whose timestamp is within [start, end].
+
+        A None bound means the beginning or the end of the log.
+        """
+
+        # select the chunks overlapping [start, end], scanning the whole
+        # index since timestamps decrease if the clock is stepped backwards
+        entries = [entry for entry in self.index\
+                   if (start is None or entry[1] >= start) and\
+                      (end is None or entry[0] <= end)]
+
+        records = []
+
+        with open(self.filename, 'rb') as fd:
+            for entry in entries:
+                for row in self.read_chunk(fd, entry):
+                    timestamp = float(row['timestamp'])
+                    if (start is None or timestamp >= start) and\
+                       (end is None or timestamp <= end):
+                        records.append(row)
+
+        return records
+
+class ChunkedLogger(FileLogger):
+    """
+    Save data from the EVB1000 serial to chunked compressed containers.
+
+    Offers the same interface of CSVLogger and uses the same file names
+    with the extension '.evbc'.
+    """
+
+    def __init__(self, chunk_records=1000, chunk_interval=60.0):
+
+        # empty dictionary of writers
+        self.writers = dict()
+
+        # chunking configuration
+        self.chunk_records = chunk_records
+        self.chunk_interval = chunk_interval
+
+    def log_data(self, evb1000_data):
+        """
+        Log new line from EVB1000 serial line.
+        """
+
+        # extract data
+        data = evb1000_data.decoded
+
+        # extract message type
+        msg_type = data['msg_type']
+
+        # filter using message type
+        if not msg_type in self.allowed_msg_types:
+            return
+
+        try:
+            writer = self.writers[msg_type]
+        except KeyError:
+
+            # if the key does not exist the container has to be
+            # created for the first time
+            filename = self.create_file_name(msg_type, data['id'])
+            writer = ChunkedLogWriter(filename + '.evbc', evb1000_data.msg_fields,\
+                                      self.chunk_records, self.chunk_interval)
+            self.writers[msg_type] = writer
+
+        writer.write(evb1000_data.timestamp,\
+                     [data[field] for field in evb1000_data.msg_fields])
+
+    def close(self):
+        """
+        Flush and close the containers.
+        """
+        for key in self.writers:
+            self.writers[key].close()
+
+if __name__ == '__main__':
+    # extract the records within a time range as csv, e.g.
+    # python -m output.chunked_logger tag_2_12_04_2018_tpr.evbc 1523520000 1523520300
+    if len(sys.argv) < 2:
+        print('Usage: python -m output.chunked_logger <file.evbc> [start] [end]')
+        sys.exit(1)
+
+    start = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    end = float(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    records = ChunkedLogReader(sys.argv[1]).read(start, end)
+
+    if records:
+        writer = csv.DictWriter(sys.stdout, list(records[0].keys()))
+        writer.writeheader()
+        writer.writerows(records)
@@ -1,40 +1,44 @@
+import os
 import csv
-import time
 
 # EVB1000 decoder
 from device.decoder import DataFromEVB1000
 
-class CSVLogger:
+# base logger
+from output.file_logger import FileLogger
+
+class CSVLogger(FileLogger):
     """
     Save data from the EVB1000 serial to a csv files.
+
+    If a RotationPolicy is given, files are rotated by size
+    and/or time and rotated segments are compressed in background.
     """
 
-    def __init__(self):
+    def __init__(self, rotation_policy=None):
 
         # empty dictionary of file descriptors
         self.files = dict()
 
-        # empty ditionary of writers
-        self.writers = dict()
+        # empty dictionary of file names
+        self.filenames = dict()
 
-        # list of allowed message types
-        self.allowed_msg_types = ['tpr', 'kmf', 'apr',\
-                                  'arr', 'trr']
-    def create_file_name(self, msg_type, device_id):
-        """
-        Generate the filename depending on the msg_type and the device ID.
-        """
+        # empty dictionary of file sizes, counted while writing since
+        # querying the file position would flush the write buffer
+        self.sizes = dict()
 
-        filename = ''
-        
-        if msg_type == 'tpr' or msg_type == 'apr' or msg_type == 'trr':
-            filename = "tag_" + str(device_id) + "_" +\
-                       time.strftime("%d_%m_%Y") + "_" + str(msg_type)
-        # maintain compatibility with MATLAB collection facilities
-        elif msg_type == 'arr':
-            filename = 'a2a_anch_' + str(device_id)
-
-        return filename
+        # empty dictionary of creation times
+        self.created_at = dict()
+
+        # log rotator, if rotation is enabled, the rotator
+        # is imported only if required
+        self.rotator = None
+        if rotation_policy is not None and rotation_policy.enabled:
+            from output.log_rotation import LogRotator
+            self.rotator = LogRotator(rotation_policy)
+
+        # empty ditionary of writers
+        self.writers = dict()
         
     def log_data(self, evb1000_data):
         """
@@ -51,32 +55,71 @@ class CSVLogger:
         if not msg_type in self.allowed_msg_types:
             return
 
+        # flagged messages have an additional column and are logged
+        # to their own file, so that every file has a single header
+        flagged = 'outliers' in data
+        key = msg_type + '_flagged' if flagged else msg_type
+
+        # rotate the file if required by the policy
+        if self.rotator is not None and key in self.files:
+            if self.rotator.should_rotate(self.sizes[key], self.created_at[key]):
+                self.rotate_file(key, evb1000_data)
+
         try:
-            self.writers[msg_type].writerow(evb1000_data.decoded)
+            self.sizes[key] += self.writers[key].writerow(evb1000_data.decoded)
         except KeyError:
             
             # if the key does not exist the file has to be
             # created for the first time
-            filename = self.create_file_name(msg_type, data['id'])
-            
-            # file is opened in append mode so that a newly
-            # connected tag with the same id logs in the same file
-            fd = open( filename + '.csv', 'a')
-            self.files[msg_type] = fd
+            filename = self.create_file_name(msg_type, data['id'], flagged)
+            self.filenames[key] = filename + '.csv'
 
-            # create a new writer
-            writer = csv.DictWriter(fd, evb1000_data.msg_fields)
-            self.writers[msg_type] = writer
-
-            # write the header
-            writer.writeheader()
+            self.open_file(key, evb1000_data)
             
             # now the new data can be written
-            writer.writerow(evb1000_data.decoded)
+            self.sizes[key] += self.writers[key].writerow(evb1000_data.decoded)
+
+    def open_file(self, key, evb1000_data):
+        """
+        Open the file associated to key, the message type possibly
+        followed by '_flagged', and write the header.
+        """
+
+        # file is opened in append mode so that a newly
+        # connected tag with the same id logs in the same file
+        filename = self.filenames[key]
+        if self.rotator is not None:
+            self.rotator.recover(filename)
+            self.created_at[key] = self.rotator.created_at(filename)
+        fd = open(filename, 'a')
+        self.files[key] = fd
+        self.sizes[key] = os.fstat(fd.fileno()).st_size
+
+        # create a new writer
+        writer = csv.DictWriter(fd, evb1000_data.msg_fields)
+        self.writers[key] = writer
+
+        # write the header
+        self.sizes[key] += writer.writeheader()
+
+    def rotate_file(self, key, evb1000_data):
+        """
+        Close the file associated to key, hand it to the rotator
+        and open a new one.
+        """
+
+        self.files[key].close()
+        self.rotator.rotate(self.filenames[key])
+        self.open_file(key, evb1000_data)
             
     def close(self):
         """
         Close the file descriptor.
+
+        Wait for pending compressions, if any.
         """
         for key in self.files:
             self.files[key].close()
+
+        if self.rotator is not None:
+            self.rotator.close()
@@ -0,0 +1,35 @@
+import time
+
+class FileLogger:
+    """
+    Base class of the loggers saving data from the EVB1000 serial to files.
+
+    Defines the message types that are logged and the name of
+    the file associated to each message type and device.
+    """
+
+    # list of allowed message types
+    allowed_msg_types = ['tpr', 'kmf', 'apr',\
+                         'arr', 'trr']
+
+    def create_file_name(self, msg_type, device_id, flagged=False):
+        """
+        Generate the filename depending on the msg_type and the device ID.
+
+        Messages with outliers flagged by the range filter have an additional
+        column, hence they are logged to files with the suffix '_flagged'.
+        """
+
+        filename = ''
+        
+        if msg_type == 'tpr' or msg_type == 'apr' or msg_type == 'trr':
+            filename = "tag_" + str(device_id) + "_" +\
+                       time.strftime("%d_%m_%Y") + "_" + str(msg_type)
+        # maintain compatibility with MATLAB collection facilities
+        elif msg_type == 'arr':
+            filename = 'a2a_anch_' + str(device_id)
+
+        if flagged:
+            filename = filename + '_flagged'
+
+        return filename
@@ -0,0 +1,312 @@
+import os
+import sys
+import time
+import glob
+
+class RotationPolicy:
+    """
+    Settings used to decide when a log file has to be rotated,
+    how rotated segments are compressed and how many of them are kept.
+
+    A value of 0 (or None) disables the corresponding limit.
+    """
+
+    # file extension appended by each compression method
+    extensions = {'gzip': '.gz', 'lzma': '.xz', 'none': ''}
+
+    def __init__(self, max_bytes=0, interval=0, compression='gzip',\
+                 max_segments=0, max_age=0, workers=1):
+
+        if not compression in self.extensions:
+            raise ValueError('Unknown compression method ' + str(compression) + '.')
+
+        # rotate when the file is at least max_bytes long
+        self.max_bytes = max_bytes
+
+        # rotate when the file has been open for interval seconds
+        self.interval = interval
+
+        # compression method for rotated segments
+        self.compression = compression
+
+        # keep at most max_segments rotated segments per log
+        self.max_segments = max_segments
+
+        # delete rotated segments older than max_age seconds
+        self.max_age = max_age
+
+        # number of background compression threads
+        self.workers = workers
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes or self.interval)
+
+class LogRotator:
+    """
+    Rotate log files according to a RotationPolicy.
+
+    Rotated segments are renamed, then compressed and pruned
+    by a pool of background threads so that the caller never
+    waits on compression.
+    """
+
+    def __init__(self, policy, close_timeout=2.0):
+
+        # save policy
+        self.policy = policy
+
+        # maximum time spent by close() waiting for compressions
+        self.close_timeout = close_timeout
+
+        # pending compressions
+        self.pending = set()
+
+        # logs whose leftover segments were already recovered
+        self.recovered = set()
+
+        # the thread pool is created on the first rotation so that
+        # the rotator can be built before the device process is started
+        self.executor = None
+
+    def should_rotate(self, size, created_at):
+        """
+        Return True if a file size bytes long, created at time created_at,
+        has to be rotated.
+        """
+
+        if self.policy.max_bytes and size >= self.policy.max_bytes:
+            return True
+
+        if self.policy.interval and time.time() - created_at >= self.policy.interval:
+            return True
+
+        return False
+
+    def created_at(self, filename):
+        """
+        Return the creation time of filename, so that the rotation interval
+        is not restarted every time the collector is restarted.
+
+        Where the creation time is not available, e.g. on Linux, the time of
+        the last rotation, embedded in the name of the newest segment, is used.
+        If the file was never rotated its modification time is used.
+        """
+
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            # the file does not exist yet
+            return time.time()
+
+        try:
+            return stat.st_birthtime
+        except AttributeError:
+            pass
+
+        segments = self.segments(filename)
+        if segments:
+            root = os.path.splitext(filename)[0]
+            stamp = segments[-1][len(root) + 1:len(root) + 16]
+            try:
+                return time.mktime(time.strptime(stamp, '%Y%m%d_%H%M%S'))
+            except ValueError:
+                pass
+
+        return stat.st_mtime
+
+    def segment_name(self, filename):
+        """
+        Return the name of a new rotated segment for filename,
+        e.g. 'a2a_anch_1.csv' -> 'a2a_anch_1.20180412_101500.csv'.
+        """
+
+        root, ext = os.path.splitext(filename)
+        stamp = time.strftime('%Y%m%d_%H%M%S')
+
+        # avoid collisions when rotating more than once per second
+        segment = root + '.' + stamp + ext
+        counter = 1
+        while os.path.exists(segment) or self.compressed_exists(segment):
+            segment = root + '.' + stamp + '_' + '%03d' % counter + ext
+            counter = counter + 1
+
+        return segment
+
+    def compressed_exists(self, segment):
+        """
+        Return True if segment already exists in compressed form.
+        """
+        extension = RotationPolicy.extensions[self.policy.compression]
+
+        return bool(extension) and os.path.exists(segment + extension)
+
+    def rotate(self, filename):
+        """
+        Rename filename to a new segment and schedule its compression
+        and the pruning of old segments.
+
+        The caller is expected to have closed filename and to reopen it.
+        """
+
+        # the file may have never been created
+        if not os.path.exists(filename):
+            return
+
+        segment = self.segment_name(filename)
+        os.rename(filename, segment)
+
+        self.submit(filename, segment)
+
+    def submit(self, filename, segment):
+        """
+        Schedule the compression of segment and the pruning of old segments of filename.
+        """
+
+        # the thread pool is imported only if a segment has to be compressed
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.executor = ThreadPoolExecutor(max_workers=self.policy.workers)
+
+        future = self.executor.submit(self.compress_and_prune, filename, segment)
+        self.pending.add(future)
+        future.add_done_callback(self.report_failure)
+
+    def recover(self, filename):
+        """
+        Compress the segments of filename left uncompressed by a previous
+        run, e.g. because the collector was stopped while compressing,
+        and remove partially written compressed segments.
+        """
+
+        if filename in self.recovered:
+            return
+        self.recovered.add(filename)
+
+        root, ext = os.path.splitext(filename)
+
+        for tmp in glob.glob(glob.escape(root) + '.*' + ext + '*.tmp'):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+        if self.policy.compression == 'none':
+            return
+
+        for segment in glob.glob(glob.escape(root) + '.*' + ext):
+            self.submit(filename, segment)
+
+    def report_failure(self, future):
+        """
+        Report a compression that failed, e.g. because the disk is full.
+        """
+
+        self.pending.discard(future)
+
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            sys.stderr.write('LogRotator[' + time.strftime("%d-%m-%Y %H:%M:%S") +\
+                             ']: error while compressing a rotated segment: ' +\
+                             str(error) + '\n')
+
+    def compress_and_prune(self, filename, segment):
+        """
+        Compress segment and remove old segments of filename.
+
+        Runs on a background thread.
+        """
+
+        self.compress(segment)
+        self.prune(filename)
+
+    def compress(self, segment):
+        """
+        Compress segment using the method in the policy
+        and remove the uncompressed copy.
+        """
+
+        # compression modules are imported only if required
+        if self.policy.compression == 'gzip':
+            import gzip
+            opener = gzip.open
+        elif self.policy.compression == 'lzma':
+            import lzma
+            opener = lzma.open
+        else:
+            return
+        import shutil
+
+        compressed = segment + RotationPolicy.extensions[self.policy.compression]
+
+        # write to a temporary file so that a partially written
+        # segment is never mistaken for a complete one
+        try:
+            with open(segment, 'rb') as src, opener(compressed + '.tmp', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        except Exception:
+            # keep the uncompressed segment
+            if os.path.exists(compressed + '.tmp'):
+                os.remove(compressed + '.tmp')
+            raise
+        os.replace(compressed + '.tmp', compressed)
+        os.remove(segment)
+
+    def segments(self, filename):
+        """
+        Return the rotated segments of filename, oldest first.
+        """
+
+        root, ext = os.path.splitext(filename)
+
+        segments = [s for s in glob.glob(glob.escape(root) + '.*' + ext + '*')\
+                    if not s.endswith('.tmp')]
+
+        # segment names embed a sortable timestamp
+        return sorted(segments)
+
+    def prune(self, filename):
+        """
+        Delete the segments of filename exceeding the retention limits.
+        """
+
+        segments = self.segments(filename)
+
+        # remove segments exceeding the maximum number
+        if self.policy.max_segments and len(segments) > self.policy.max_segments:
+            expired = segments[:len(segments) - self.policy.max_segments]
+            segments = segments[len(expired):]
+        else:
+            expired = []
+
+        # remove segments exceeding the maximum age
+        if self.policy.max_age:
+            now = time.time()
+            for s in segments:
+                try:
+                    if now - os.path.getmtime(s) > self.policy.max_age:
+                        expired.append(s)
+                except OSError:
+                    pass
+
+        for s in expired:
+            try:
+                os.remove(s)
+            except OSError:
+                pass
+
+    def close(self):
+        """
+        Wait for pending compressions to complete, at most close_timeout seconds.
+
+        Segments left uncompressed are compressed by recover() on the next run.
+        """
+
+        if self.executor is not None:
+            from concurrent.futures import wait
+            wait(list(self.pending), timeout=self.close_timeout)
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,61 @@
+# logger factory
+from functools import partial
+
+# csv logger, the chunked logger is imported only if required
+from output.csv_logger import CSVLogger
+
+def add_logger_arguments(parser):
+    """
+    Add the command line arguments configuring the loggers to parser.
+    """
+
+    # log format
+    parser.add_argument('--format', choices=['csv', 'chunked'], default='csv',\
+                        help='log to plain csv files or to chunked compressed containers')
+    parser.add_argument('--chunk-records', type=int, default=1000,\
+                        help='maximum number of records in a chunk')
+    parser.add_argument('--chunk-interval', type=float, default=60,\
+                        help='maximum number of seconds spanned by a chunk')
+
+    # log rotation (csv format only)
+    parser.add_argument('--rotate-size', type=float, default=0,\
+                        help='rotate log files larger than ROTATE_SIZE megabytes')
+    parser.add_argument('--rotate-interval', type=float, default=0,\
+                        help='rotate log files open for more than ROTATE_INTERVAL seconds')
+    parser.add_argument('--compression', choices=['gzip', 'lzma', 'none'], default='gzip',\
+                        help='compression method for rotated log files')
+    parser.add_argument('--keep', type=int, default=0,\
+                        help='keep at most KEEP rotated segments for each log file')
+    parser.add_argument('--max-age', type=float, default=0,\
+                        help='delete rotated segments older than MAX_AGE days')
+
+def check_logger_arguments(parser, args):
+    """
+    Exit with an error if the parsed arguments args configure
+    the loggers inconsistently.
+    """
+
+    # chunked containers are never rotated
+    if args.format == 'chunked' and\
+       (args.rotate_size or args.rotate_interval or args.keep or args.max_age):
+        parser.error('log rotation (--rotate-size, --rotate-interval, --keep, --max-age) ' +\
+                     'is supported only by the csv format')
+
+def create_logger_factory(args):
+    """
+    Return the callable creating a logger as configured by the parsed arguments args.
+    """
+
+    if args.format == 'chunked':
+        from output.chunked_logger import ChunkedLogger
+        return partial(ChunkedLogger, args.chunk_records, args.chunk_interval)
+
+    # log rotation
+    from output.log_rotation import RotationPolicy
+    rotation_policy = RotationPolicy(max_bytes=int(args.rotate_size * 1024 * 1024),\
+                                     interval=args.rotate_interval,\
+                                     compression=args.compression,\
+                                     max_segments=args.keep,\
+                                     max_age=args.max_age * 24 * 3600)
+
+    return partial(CSVLogger, rotation_policy)